@@ -1,14 +1,13 @@
 import asyncio
 import logging
-import string
+import re
 import secrets
 import hashlib
-from datetime import datetime
 
 import aiosqlite
-import validators
-from aiogram import Bot, Dispatcher, F, types
-from aiogram.filters import Command, CommandStart
+from aiogram import Bot, Dispatcher, F, Router, types
+from aiogram.filters import Command, CommandObject, CommandStart
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from config import BOT_TOKEN
 
@@ -17,8 +16,65 @@ from config import BOT_TOKEN
 TOKEN=BOT_TOKEN
 DB_PATH = "bot_database.db"
 APP_ID = "link_shortener_v1"
+PAGE_SIZE = 20
+
+# Общее соединение с БД, открывается в main()
+DB = None
+
+# Сериализует группы запись+commit на общем соединении: хендлеры
+# выполняются конкурентно, и чужой commit/BEGIN посреди чужой
+# транзакции ломает атомарность
+DB_WRITE_LOCK = asyncio.Lock()
+
+# Имя бота для сокращенных ссылок, кэшируется в main()
+BOT_USERNAME = None
+
+# Проверка URL: компилируется один раз вместо validators.url на каждый запрос
+_URL_RE = re.compile(r'^https?://[^\s/$.?#].[^\s]*$', re.IGNORECASE)
+
+# --- SQL ---
+# Одинаковый текст запроса на каждый вызов: кэш подготовленных
+# стейтментов sqlite3 попадает по нему без повторного парсинга
+SQL_SELECT_URL = "SELECT original_url FROM short_links WHERE short_id = ?"
+SQL_INSERT_USER = """
+    INSERT OR IGNORE INTO user (telegram_id, username, nickname, meta_data_id)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_INSERT_META = """
+    INSERT INTO meta_data (id, user_tg_reg_date, device_meta, browser)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_UPSERT_LINK = """
+    INSERT INTO short_links (short_id, original_url, creator_id)
+    VALUES (?, ?, ?)
+    ON CONFLICT(creator_id, original_url) DO UPDATE SET original_url = excluded.original_url
+    RETURNING short_id
+"""
+SQL_SELECT_USER_LINKS = """
+    SELECT short_id, original_url FROM short_links
+    WHERE creator_id = ?
+    ORDER BY rowid DESC
+    LIMIT ? OFFSET ?
+"""
+SQL_SELECT_LINK = "SELECT original_url, creator_id FROM short_links WHERE short_id = ?"
+SQL_INSERT_DELETED = """
+    INSERT INTO deleted_links_hash (hash_id, original_url_hash, creator_id)
+    VALUES (?, ?, ?)
+"""
+SQL_DELETE_LINK = "DELETE FROM short_links WHERE short_id = ?"
+SQL_SELECT_USER_FOLDERS = "SELECT folder_id, name FROM folders WHERE creator_id = ?"
+SQL_INSERT_FOLDER = "INSERT INTO folders (folder_id, name, creator_id) VALUES (?, ?, ?)"
 
 # --- DATABASE LOGIC ---
+async def apply_pragmas(db):
+    # WAL сохраняется в файле БД, остальные PRAGMA действуют на соединение
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA cache_size=-64000")
+    # Чтение страниц через mmap вместо pread; ядро мапит только то, что трогаем
+    await db.execute("PRAGMA mmap_size=268435456")
+
 async def init_db():
     async with aiosqlite.connect(DB_PATH) as db:
         # Таблица метаданных
@@ -26,7 +82,7 @@ async def init_db():
             CREATE TABLE IF NOT EXISTS meta_data (
                 id TEXT PRIMARY KEY,
                 user_tg_reg_date TEXT,
-                user_bot_reg_date TEXT,
+                user_bot_reg_date INTEGER DEFAULT (unixepoch()),
                 device_meta TEXT,
                 browser TEXT
             )
@@ -48,7 +104,7 @@ async def init_db():
                 original_url TEXT,
                 creator_id INTEGER,
                 folder_id TEXT,
-                created_at TEXT
+                created_at INTEGER DEFAULT (unixepoch())
             )
         """)
         # Таблица папок
@@ -63,60 +119,81 @@ async def init_db():
         await db.execute("""
             CREATE TABLE IF NOT EXISTS deleted_links_hash (
                 hash_id TEXT PRIMARY KEY,
-                original_url_hash TEXT,
-                deleted_at TEXT,
+                original_url_hash BLOB,
+                deleted_at INTEGER DEFAULT (unixepoch()),
                 creator_id INTEGER
             )
         """)
+        # Индексы для выборок по владельцу (/my_links, /folders)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_short_links_creator ON short_links(creator_id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_folders_creator ON folders(creator_id)")
+        # Одна и та же ссылка от одного пользователя не создает новых строк
+        await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_short_links_user_url ON short_links(creator_id, original_url)")
+        await apply_pragmas(db)
         await db.commit()
 
-def generate_id(length=12):
-    chars = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(chars) for _ in range(length))
+def _log_task_error(task):
+    # Ошибки fire-and-forget задач иначе пропадают молча
+    if not task.cancelled() and task.exception():
+        logging.error("Фоновая задача завершилась с ошибкой", exc_info=task.exception())
+
+def hash_url(url):
+    # 32-байтный digest; hashlib отдает SHA-256 в OpenSSL (SHA-NI на x86)
+    return hashlib.sha256(url.encode()).digest()
+
+def generate_id(length=8):
+    # Один вызов os.urandom вместо цикла secrets.choice; алфавит A-Za-z0-9_-
+    return secrets.token_urlsafe(length)[:length]
 
 # --- BOT INITIALIZATION ---
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
 
+# Отдельные роутеры по типу апдейта: callback'и не проходят фильтры сообщений
+msg_router = Router()
+cb_router = Router()
+
+# --- CALLBACK DATA ---
+
+class DeleteLink(CallbackData, prefix="del"):
+    short_id: str
+
+class LinksPage(CallbackData, prefix="page"):
+    page: int
+
 # --- HANDLERS ---
 
-@dp.message(CommandStart())
-async def cmd_start(message: types.Message):
+@msg_router.message(CommandStart())
+async def cmd_start(message: types.Message, command: CommandObject):
     # Проверка на deep-link (переход по сокращенной ссылке)
-    args = message.text.split()
-    if len(args) > 1:
-        short_id = args[1]
-        async with aiosqlite.connect(DB_PATH) as db:
-            async with db.execute("SELECT original_url FROM short_links WHERE short_id = ?", (short_id,)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return await message.answer(
-                        f"🔗 Ваша ссылка готова:\n{row[0]}",
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="Перейти", url=row[0])]
-                        ])
-                    )
-                else:
-                    return await message.answer("❌ Ссылка не найдена или была удалена.")
-
-    # Регистрация пользователя
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT telegram_id FROM user WHERE telegram_id = ?", (message.from_user.id,)) as cursor:
-            if not await cursor.fetchone():
-                m_id = generate_id()
-                now = datetime.now().isoformat()
-                
+    if command.args:
+        short_id = command.args
+        async with DB.execute(SQL_SELECT_URL, (short_id,)) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return await message.answer(
+                    f"🔗 Ваша ссылка готова:\n{row[0]}",
+                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                        [InlineKeyboardButton(text="Перейти", url=row[0])]
+                    ])
+                )
+            else:
+                return await message.answer("❌ Ссылка не найдена или была удалена.")
+
+    # Регистрация пользователя: OR IGNORE вместо отдельного SELECT
+    m_id = generate_id()
+    async with DB_WRITE_LOCK:
+        # Сразу берем блокировку записи, чтобы не ловить SQLITE_BUSY на апгрейде
+        await DB.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = await DB.execute(SQL_INSERT_USER, (message.from_user.id, message.from_user.username, message.from_user.full_name, m_id))
+            if cursor.rowcount:
                 # Имитация получения метаданных (в реальном боте через API ограничено)
-                await db.execute("""
-                    INSERT INTO meta_data (id, user_tg_reg_date, user_bot_reg_date, device_meta, browser)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (m_id, "Unknown", now, "Mobile/Desktop", "In-App Telegram"))
-                
-                await db.execute("""
-                    INSERT INTO user (telegram_id, username, nickname, meta_data_id)
-                    VALUES (?, ?, ?, ?)
-                """, (message.from_user.id, message.from_user.username, message.from_user.full_name, m_id))
-                await db.commit()
+                await DB.execute(SQL_INSERT_META, (m_id, "Unknown", "Mobile/Desktop", "In-App Telegram"))
+            await DB.commit()
+        except Exception:
+            await DB.rollback()
+            raise
 
     await message.answer(
         "👋 Привет! Я бот для сокращения ссылок.\n\n"
@@ -125,23 +202,25 @@ async def cmd_start(message: types.Message):
         "🔹 Использу/folders для управления папками."
     )
 
-@dp.message(F.text.regexp(r'^https?://'))
+@msg_router.message(F.text.regexp(r'^https?://'))
 async def create_link(message: types.Message):
     url = message.text.strip()
-    if not validators.url(url):
+    if not _URL_RE.match(url):
         return await message.answer("❌ Некорректный формат ссылки.")
 
-    short_id = generate_id()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            INSERT INTO short_links (short_id, original_url, creator_id, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (short_id, url, message.from_user.id, datetime.now().isoformat()))
-        await db.commit()
+    # Повторное сокращение той же ссылки возвращает уже существующий short_id
+    async with DB_WRITE_LOCK:
+        try:
+            cursor = await DB.execute(SQL_UPSERT_LINK, (generate_id(), url, message.from_user.id))
+            row = await cursor.fetchone()
+            short_id = row[0]
+            await DB.commit()
+        except Exception:
+            await DB.rollback()
+            raise
+
+    short_url = f"https://t.me/{BOT_USERNAME}?start={short_id}"
 
-    bot_info = await bot.get_me()
-    short_url = f"https://t.me/{bot_info.username}?start={short_id}"
-    
     await message.answer(
         f"✅ Ссылка сокращена!\n\n"
         f"Оригинал: {url}\n"
@@ -149,82 +228,147 @@ async def create_link(message: types.Message):
         parse_mode="Markdown"
     )
 
-@dp.message(Command("my_links"))
-async def list_links(message: types.Message):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT short_id, original_url FROM short_links WHERE creator_id = ?", (message.from_user.id,)) as cursor:
-            links = await cursor.fetchall()
-            
+async def render_links_page(user_id, page):
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    async with DB.execute(SQL_SELECT_USER_LINKS, (user_id, PAGE_SIZE + 1, page * PAGE_SIZE)) as cursor:
+        links = await cursor.fetchall()
+
     if not links:
+        return None, None
+
+    has_next = len(links) > PAGE_SIZE
+    links = links[:PAGE_SIZE]
+
+    text = "📂 Ваши ссылки:\n\n" + "\n".join(
+        f"• {url[:30]}... (ID: `{s_id}`)" for s_id, url in links
+    )
+    keyboard = [
+        [InlineKeyboardButton(text=f"Удалить {s_id}", callback_data=DeleteLink(short_id=s_id).pack())]
+        for s_id, _ in links
+    ]
+    if has_next:
+        keyboard.append([InlineKeyboardButton(text="Далее ➡️", callback_data=LinksPage(page=page + 1).pack())])
+
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@msg_router.message(Command("my_links"))
+async def list_links(message: types.Message):
+    text, markup = await render_links_page(message.from_user.id, 0)
+    if text is None:
         return await message.answer("У вас еще нет сокращенных ссылок.")
+    await message.answer(text, reply_markup=markup, parse_mode="Markdown")
+
+@cb_router.callback_query(LinksPage.filter())
+async def links_page_callback(callback: types.CallbackQuery, callback_data: LinksPage):
+    page = callback_data.page
+    text, markup = await render_links_page(callback.from_user.id, page)
+    if text is None:
+        return await callback.answer("Больше ссылок нет.")
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="Markdown")
+    await callback.answer()
+
+@cb_router.callback_query(DeleteLink.filter())
+async def delete_link_callback(callback: types.CallbackQuery, callback_data: DeleteLink):
+    short_id = callback_data.short_id
+
+    # Быстрая проверка до записи: несуществующая ссылка — это тост,
+    # список с клавиатурой остается на месте
+    async with DB.execute(SQL_SELECT_LINK, (short_id,)) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return await callback.answer("❌ Ссылка не найдена.")
+
+    # Гасим спиннер у клиента до работы с БД
+    await callback.answer()
+
+    async with DB_WRITE_LOCK:
+        # Сразу берем блокировку записи; перечитываем внутри транзакции,
+        # чтобы повторное нажатие той же кнопки увидело уже удаленную строку
+        await DB.execute("BEGIN IMMEDIATE")
+        try:
+            async with DB.execute(SQL_SELECT_LINK, (short_id,)) as cursor:
+                row = await cursor.fetchone()
 
-    text = "📂 Ваши ссылки:\n\n"
-    keyboard = []
-    for s_id, url in links:
-        text += f"• {url[:30]}... (ID: `{s_id}`)\n"
-        keyboard.append([InlineKeyboardButton(text=f"Удалить {s_id}", callback_data=f"del_{s_id}")])
-    
-    await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="Markdown")
-
-@dp.callback_query(F.data.startswith("del_"))
-async def delete_link_callback(callback: types.CallbackQuery):
-    short_id = callback.data.split("_")[1]
-    
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем данные перед удалением для хэширования
-        async with db.execute("SELECT original_url, creator_id FROM short_links WHERE short_id = ?", (short_id,)) as cursor:
-            row = await cursor.fetchone()
             if row:
                 url, creator_id = row
-                url_hash = hashlib.sha256(url.encode()).hexdigest()
-                
+
                 # Сохраняем в таблицу удаленных
-                await db.execute("""
-                    INSERT INTO deleted_links_hash (hash_id, original_url_hash, deleted_at, creator_id)
-                    VALUES (?, ?, ?, ?)
-                """, (short_id, url_hash, datetime.now().isoformat(), creator_id))
-                
+                await DB.execute(SQL_INSERT_DELETED, (short_id, hash_url(url), creator_id))
+
                 # Удаляем оригинал
-                await db.execute("DELETE FROM short_links WHERE short_id = ?", (short_id,))
-                await db.commit()
-                await callback.answer("✅ Ссылка удалена и хэширована.")
-                await callback.message.edit_text("Ссылка была успешно удалена.")
-            else:
-                await callback.answer("❌ Ссылка не найдена.")
+                await DB.execute(SQL_DELETE_LINK, (short_id,))
+            await DB.commit()
+        except Exception:
+            await DB.rollback()
+            raise
 
-@dp.message(Command("folders"))
+    # Если строки уже не было, ее удалило конкурентное нажатие —
+    # для пользователя результат тот же
+    # Правка сообщения не блокирует обработку следующего апдейта
+    task = asyncio.create_task(callback.message.edit_text("Ссылка была успешно удалена."))
+    task.add_done_callback(_log_task_error)
+
+@msg_router.message(Command("folders"))
 async def cmd_folders(message: types.Message):
     # Упрощенная логика папок: просмотр существующих
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT folder_id, name FROM folders WHERE creator_id = ?", (message.from_user.id,)) as cursor:
-            folders = await cursor.fetchall()
-            
+    async with DB.execute(SQL_SELECT_USER_FOLDERS, (message.from_user.id,)) as cursor:
+        folders = await cursor.fetchall()
+
     if not folders:
         # Кнопка создания для примера
         kb = [[InlineKeyboardButton(text="Создать папку 'Работа'", callback_data="create_folder_work")]]
         return await message.answer("У вас пока нет папок.", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
-    text = "🗂 Ваши папки:\n"
-    for f_id, name in folders:
-        text += f"• {name} (ID: `{f_id}`)\n"
+    text = "🗂 Ваши папки:\n" + "\n".join(
+        f"• {name} (ID: `{f_id}`)" for f_id, name in folders
+    )
     await message.answer(text, parse_mode="Markdown")
 
-@dp.callback_query(F.data == "create_folder_work")
+@cb_router.callback_query(F.data == "create_folder_work")
 async def create_folder_example(callback: types.CallbackQuery):
     f_id = generate_id()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT INTO folders (folder_id, name, creator_id) VALUES (?, ?, ?)", 
-                         (f_id, "Работа", callback.from_user.id))
-        await db.commit()
+    async with DB_WRITE_LOCK:
+        try:
+            await DB.execute(SQL_INSERT_FOLDER,
+                             (f_id, "Работа", callback.from_user.id))
+            await DB.commit()
+        except Exception:
+            await DB.rollback()
+            raise
     await callback.message.edit_text(f"✅ Создана папка 'Работа' с ID: `{f_id}`", parse_mode="Markdown")
 
+dp.include_router(msg_router)
+dp.include_router(cb_router)
+
 # --- MAIN ---
 async def main():
-    logging.basicConfig(level=logging.INFO)
+    global DB, BOT_USERNAME
     await init_db()
-    await dp.start_polling(bot)
+    # Имя бота не меняется за время работы процесса
+    me = await bot.get_me()
+    BOT_USERNAME = me.username
+    # Одно соединение на весь процесс: без накладных расходов
+    # на поток и разогрев кэша страниц при каждом запросе
+    DB = await aiosqlite.connect(DB_PATH)
+    await apply_pragmas(DB)
+    await DB.commit()
+    try:
+        # Длинный long-poll и только нужные типы апдейтов
+        await dp.start_polling(
+            bot,
+            polling_timeout=30,
+            allowed_updates=["message", "callback_query"],
+        )
+    finally:
+        await DB.close()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # uvloop недоступен (например, Windows) — стандартный цикл asyncio
     try:
         asyncio.run(main())
     except KeyboardInterrupt: